@@ -1,8 +1,97 @@
+import asyncio
+import hashlib
+import heapq
 import requests
 import json
 import os
-from typing import Optional, Dict, Any, List
+import re
+import sys
+import threading
+import time
+from xml.parsers import expat
+from collections import defaultdict
+from operator import itemgetter
+from typing import Optional, Dict, Any, List, Tuple, Union
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Decode JSON responses with orjson when it is installed
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+# Patterns for the regex fallback parser, compiled once at import
+_URL_RE = re.compile(r'<URL>(.*?)</URL>')
+_META_RE = re.compile(r'<META name="([^"]+)" value="([^"]+)"(?: id="([^"]+)" score="([^"]+)")?')
+_SYS_RE = re.compile(r'<SYSTEM name="([^"]+)" value="([^"]+)"')
+
+# Token cache location and lifetime used when the token response has no expires_in
+DEFAULT_TOKEN_CACHE = os.path.expanduser("~/.cache/semaphore/token.json")
+DEFAULT_TOKEN_TTL = 3600
+
+
+class _StopParsing(Exception):
+    """
+    Raised from an expat handler to end parsing once the wanted data is found.
+    """
+
+class _ClassificationXMLHandler:
+    """
+    Collect META, SYSTEM and URL data from expat parser events.
+    """
+    
+    def __init__(self):
+        self.url = None
+        self.classifications = {}
+        self.system_info = {}
+        self._url_parts = None
+    
+    def parse(self, xml: str) -> None:
+        # The decoded text is re-encoded as UTF-8, which overrides any
+        # encoding declared in the document
+        parser = expat.ParserCreate('utf-8')
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+        parser.Parse(xml.encode('utf-8'), True)
+    
+    def start_element(self, name: str, attrs: Dict[str, str]) -> None:
+        if name == 'META':
+            score = attrs.get('score')
+            self.classifications.setdefault(attrs.get('name'), []).append({
+                'value': attrs.get('value'),
+                'id': attrs.get('id') or None,
+                'score': float(score) if score else None
+            })
+        elif name == 'SYSTEM':
+            self.system_info[attrs.get('name')] = attrs.get('value')
+        elif name == 'URL' and self.url is None:
+            self._url_parts = []
+    
+    def character_data(self, data: str) -> None:
+        if self._url_parts is not None:
+            self._url_parts.append(data)
+    
+    def end_element(self, name: str) -> None:
+        if name == 'URL' and self._url_parts is not None:
+            # Only the first URL element counts, even if it is empty
+            self.url = ''.join(self._url_parts)
+            self._url_parts = None
+
+class _LoggingRetry(Retry):
+    """
+    Retry policy that reports each retry on stderr so batch progress stays visible.
+    """
+    
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        new_retry = super().increment(method=method, url=url, response=response, error=error,
+                                      _pool=_pool, _stacktrace=_stacktrace)
+        reason = f"HTTP {response.status}" if response is not None else error
+        print(f"⚠️  Retrying {method} {url} after {reason} ({new_retry.total} retries left)", file=sys.stderr)
+        return new_retry
 
 class SemaphoreClassificationClient:
     """
@@ -12,13 +101,18 @@ class SemaphoreClassificationClient:
     Classification Service provided by Progress Cloud.
     """
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, pool_maxsize: int = 32,
+                 token_cache_path: Optional[str] = DEFAULT_TOKEN_CACHE):
         """
         Initialize the Semaphore Classification Client.
         
         Args:
             api_key (str, optional): Your Semaphore API key. If not provided, 
                                    will try to load from SEMAPHORE_API_KEY environment variable.
+            pool_maxsize (int): The maximum number of pooled connections, which should be
+                                at least the number of threads sharing the client.
+            token_cache_path (str, optional): File used to cache the access token between
+                                            runs. Pass None to disable token caching.
         """
         load_dotenv()
         
@@ -32,34 +126,212 @@ class SemaphoreClassificationClient:
         self.alternative_classification_url = f"{self.base_url}/classification/"
         
         self.access_token = None
+        self.token_cache_path = token_cache_path
+        # Serialises re-authentication when the client is shared between threads
+        self._auth_lock = threading.Lock()
+        
+        # Shared session so repeated calls reuse pooled keep-alive connections
+        self._session = requests.Session()
+        self.configure_pool(pool_maxsize)
     
-    def authenticate(self) -> str:
+    def configure_pool(self, size: int) -> None:
+        """
+        Size the session's connection pool, e.g. to match a number of worker threads.
+        
+        Transient failures (rate limiting, gateway errors) on pooled connections
+        are retried with exponential backoff, honouring any Retry-After header.
+        
+        Args:
+            size (int): The maximum number of pooled connections to the service.
+        """
+        retry = _LoggingRetry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False
+        )
+        # All requests go to a single host, so one host pool is enough
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=retry)
+        old_adapter = self._session.adapters.get("https://")
+        self._session.mount("https://", adapter)
+        if old_adapter is not None:
+            old_adapter.close()
+    
+    def close(self) -> None:
+        """
+        Close the underlying HTTP session and release pooled connections.
+        """
+        self._session.close()
+    
+    def __enter__(self) -> "SemaphoreClassificationClient":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+    
+    def authenticate(self, use_cache: bool = True) -> str:
         """
         Generate an authentication token for the session.
         
+        A token cached by an earlier run is reused while it has not expired,
+        skipping the token request entirely.
+        
+        Args:
+            use_cache (bool): Whether to reuse a cached token if one is available.
+        
         Returns:
             str: The access token for subsequent API calls.
             
         Raises:
             requests.RequestException: If authentication fails.
         """
+        if use_cache:
+            cached_token = self._load_cached_token()
+            if cached_token:
+                self._set_access_token(cached_token)
+                return self.access_token
+        
         payload = {"key": self.api_key, "grantType": "apikey"}
-        response = requests.post(self.token_url, json=payload, headers={"Content-Type": "application/json"})
+        response = self._session.post(self.token_url, json=payload)
         response.raise_for_status()
         
         token_data = response.json()
-        self.access_token = token_data.get("access_token")
-        if not self.access_token:
+        access_token = token_data.get("access_token")
+        if not access_token:
             raise ValueError("No access token received")
+        self._set_access_token(access_token)
+        self._save_cached_token(token_data.get("expires_in") or DEFAULT_TOKEN_TTL)
         return self.access_token
     
-    def classify_text(self, text: str, title: Optional[str] = None, threshold: Optional[int] = None, 
+    def invalidate_token(self) -> None:
+        """
+        Forget the current access token and remove it from the token cache.
+        """
+        self.access_token = None
+        self._session.headers.pop("Authorization", None)
+        self._remove_cached_token()
+    
+    def _remove_cached_token(self) -> None:
+        if self.token_cache_path:
+            try:
+                os.remove(self.token_cache_path)
+            except OSError:
+                pass
+    
+    def _set_access_token(self, access_token: str) -> None:
+        self.access_token = access_token
+        self._session.headers["Authorization"] = f"bearer {access_token}"
+    
+    def _api_key_hash(self) -> str:
+        # Tie cached tokens to the API key without writing the key to disk
+        return hashlib.sha256(self.api_key.encode('utf-8')).hexdigest()
+    
+    def _load_cached_token(self) -> Optional[str]:
+        """
+        Load the cached access token if it belongs to this API key and is still valid.
+        
+        Returns:
+            str: The cached token, or None if there is no usable cached token.
+        """
+        if not self.token_cache_path:
+            return None
+        try:
+            with open(self.token_cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if not isinstance(cached, dict) or cached.get("key") != self._api_key_hash():
+            return None
+        # Leave a margin so the token does not expire mid-request
+        if cached.get("exp", 0) <= time.time() + 30:
+            return None
+        return cached.get("token")
+    
+    def _save_cached_token(self, ttl: float) -> None:
+        """
+        Write the current access token to the token cache, readable only by the user.
+        
+        Args:
+            ttl (float): The number of seconds the token remains valid.
+        """
+        if not self.token_cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.token_cache_path), mode=0o700, exist_ok=True)
+            fd = os.open(self.token_cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "key": self._api_key_hash(),
+                    "token": self.access_token,
+                    "exp": time.time() + float(ttl)
+                }, f)
+        except (OSError, ValueError):
+            # Caching is best effort; authentication already succeeded
+            pass
+    
+    def _ensure_token(self) -> None:
+        """
+        Authenticate if no token is available yet, once across concurrent callers.
+        """
+        if not self.access_token:
+            with self._auth_lock:
+                if not self.access_token:
+                    self.authenticate()
+    
+    def _replace_rejected_token(self, rejected_token: Optional[str]) -> None:
+        """
+        Fetch a fresh token after the service rejected one.
+        
+        Threads that saw the same token rejected wait on the lock, and only
+        the first one authenticates again; the rest reuse its new token.
+        
+        Args:
+            rejected_token (str, optional): The token the failed request was sent with.
+        """
+        with self._auth_lock:
+            if self.access_token == rejected_token:
+                # Other threads may be sending requests with the session headers,
+                # so overwrite the Authorization header rather than removing it
+                self._remove_cached_token()
+                self.authenticate(use_cache=False)
+    
+    def _post(self, endpoint: str, data: Dict[str, Any], files: Optional[Dict[str, Any]] = None) -> requests.Response:
+        """
+        POST to a classification endpoint, re-authenticating once if the token was rejected.
+        
+        Args:
+            endpoint (str): The URL to post to.
+            data (dict): The form fields to send.
+            files (dict, optional): Files for a multipart upload.
+        
+        Returns:
+            requests.Response: The successful response.
+        
+        Raises:
+            requests.RequestException: If the request fails.
+        """
+        token = self.access_token
+        response = self._session.post(endpoint, data=data, files=files)
+        if response.status_code == 401:
+            # The (possibly cached) token has expired or been revoked
+            self._replace_rejected_token(token)
+            if files:
+                for file_spec in files.values():
+                    file_spec[1].seek(0)
+            response = self._session.post(endpoint, data=data, files=files)
+        response.raise_for_status()
+        return response
+    
+    def classify_text(self, text: Union[str, bytes], title: Optional[str] = None, threshold: Optional[int] = None, 
                      language: Optional[str] = None, use_alternative_endpoint: bool = False) -> Dict[str, Any]:
         """
         Classify text using the Semaphore Classification Service with optional parameters.
         
         Args:
-            text (str): The text to classify.
+            text (str or bytes): The text to classify. Bytes are sent as-is and
+                                 should be UTF-8 encoded.
             title (str, optional): The title of the document.
             threshold (int, optional): The threshold for classification.
             language (str, optional): The language of the document.
@@ -73,11 +345,9 @@ class SemaphoreClassificationClient:
             requests.RequestException: If classification request fails.
             ValueError: If no access token is available.
         """
-        if not self.access_token:
-            self.authenticate()
+        self._ensure_token()
         
         endpoint = self.alternative_classification_url if use_alternative_endpoint else self.classification_url
-        headers = {"Authorization": f"bearer {self.access_token}"}
         
         data = {"body": text}
         if title:
@@ -87,13 +357,9 @@ class SemaphoreClassificationClient:
         if language:
             data["language"] = language
         
-        response = requests.post(endpoint, data=data, headers=headers)
-        response.raise_for_status()
+        response = self._post(endpoint, data)
         
-        try:
-            return response.json()
-        except json.JSONDecodeError:
-            return {"raw_response": response.text}
+        return self._decode_response(response)
     
     def classify_file(self, file_path: str, title: Optional[str] = None, threshold: Optional[int] = None,
                      language: Optional[str] = None, use_alternative_endpoint: bool = False) -> Dict[str, Any]:
@@ -115,14 +381,12 @@ class SemaphoreClassificationClient:
             requests.RequestException: If classification request fails.
             ValueError: If no access token is available.
         """
-        if not self.access_token:
-            self.authenticate()
+        self._ensure_token()
         
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
         
         endpoint = self.alternative_classification_url if use_alternative_endpoint else self.classification_url
-        headers = {"Authorization": f"bearer {self.access_token}"}
         
         with open(file_path, 'rb') as f:
             files = {"UploadFile": (os.path.basename(file_path), f, "application/octet-stream")}
@@ -134,18 +398,67 @@ class SemaphoreClassificationClient:
             if language:
                 data["language"] = language
             
-            response = requests.post(endpoint, files=files, data=data, headers=headers)
-            response.raise_for_status()
+            response = self._post(endpoint, data, files=files)
         
-        try:
-            return response.json()
-        except json.JSONDecodeError:
-            return {"raw_response": response.text}
+        return self._decode_response(response)
+    
+    def _decode_response(self, response: requests.Response) -> Dict[str, Any]:
+        """
+        Decode a classification response based on its Content-Type.
+        
+        XML and other non-JSON responses are wrapped as {"raw_response": text}
+        without running the JSON parser over them first.
+        
+        Args:
+            response (requests.Response): The classification response.
+        
+        Returns:
+            dict: The decoded JSON, or the raw response text.
+        """
+        if "json" in response.headers.get("Content-Type", ""):
+            try:
+                return _json_loads(response.content)
+            except ValueError:
+                pass
+        return {"raw_response": response.text}
+    
+    async def classify_text_async(self, text: str, **kwargs: Any) -> Dict[str, Any]:
+        """
+        Coroutine version of classify_text for use from an asyncio event loop.
+        
+        The request runs in a worker thread over the shared session, so many
+        coroutines can be awaited together (e.g. with asyncio.gather) without
+        blocking the loop.
+        
+        Args:
+            text (str): The text to classify.
+            **kwargs: Optional arguments accepted by classify_text.
+        
+        Returns:
+            dict: The classification results in XML format (parsed as dict).
+        """
+        return await asyncio.to_thread(self.classify_text, text, **kwargs)
+    
+    async def classify_file_async(self, file_path: str, **kwargs: Any) -> Dict[str, Any]:
+        """
+        Coroutine version of classify_file for use from an asyncio event loop.
+        
+        Args:
+            file_path (str): The path to the file to classify.
+            **kwargs: Optional arguments accepted by classify_file.
+        
+        Returns:
+            dict: The classification results in XML format (parsed as dict).
+        """
+        return await asyncio.to_thread(self.classify_file, file_path, **kwargs)
     
     def parse_classification_results(self, result: Dict[str, Any]) -> Dict[str, Any]:
         """
         Parse classification results into a structured format.
         
+        The parsed dict is cached on the result under '_parsed', so repeated
+        calls (including via get_top_classifications) do not re-parse the XML.
+        
         Args:
             result (dict): The classification result in XML format.
         
@@ -155,29 +468,75 @@ class SemaphoreClassificationClient:
         if 'raw_response' not in result:
             return result
         
-        import re
+        # Reuse the parse from an earlier call on the same response
+        if '_parsed' in result:
+            return result['_parsed']
+        
         xml = result['raw_response']
+        try:
+            parsed = self._parse_xml(xml)
+        except expat.ExpatError:
+            parsed = self._parse_xml_regex(xml)
+        
+        result['_parsed'] = parsed
+        return parsed
+    
+    def _parse_xml(self, xml: str) -> Dict[str, Any]:
+        """
+        Parse classification XML in a single streaming expat pass.
+        
+        Only element events are handled, so no element tree is built and
+        memory stays bounded on large responses.
+        
+        Args:
+            xml (str): The raw classification XML.
+        
+        Returns:
+            dict: The parsed classification results.
+        
+        Raises:
+            xml.parsers.expat.ExpatError: If the XML is not well-formed.
+        """
+        handler = _ClassificationXMLHandler()
+        handler.parse(xml)
+        
+        return {
+            'document_info': {'url': handler.url},
+            'classifications': handler.classifications,
+            'system_info': handler.system_info,
+            'raw_xml': xml
+        }
+    
+    def _parse_xml_regex(self, xml: str) -> Dict[str, Any]:
+        """
+        Parse classification XML with regular expressions.
+        
+        Used as a fallback when the response is not well-formed XML.
         
+        Args:
+            xml (str): The raw classification XML.
+        
+        Returns:
+            dict: The parsed classification results.
+        """
         # Extract basic document info
         doc_info = {}
-        doc_info['url'] = re.search(r'<URL>(.*?)</URL>', xml)
-        doc_info['url'] = doc_info['url'].group(1) if doc_info['url'] else None
+        url_match = _URL_RE.search(xml)
+        doc_info['url'] = url_match.group(1) if url_match else None
         
         # Extract all META fields with scores
-        meta_fields = re.findall(r'<META name="([^"]+)" value="([^"]+)"(?: id="([^"]+)" score="([^"]+)")?', xml)
-        classifications = {}
-        for name, value, id_val, score in meta_fields:
-            if name not in classifications:
-                classifications[name] = []
+        classifications = defaultdict(list)
+        for match in _META_RE.finditer(xml):
+            name, value, id_val, score = match.groups()
             classifications[name].append({
                 'value': value,
                 'id': id_val if id_val else None,
                 'score': float(score) if score else None
             })
+        classifications = dict(classifications)
         
         # Extract SYSTEM fields
-        system_fields = re.findall(r'<SYSTEM name="([^"]+)" value="([^"]+)"', xml)
-        system_info = {name: value for name, value in system_fields}
+        system_info = {match.group(1): match.group(2) for match in _SYS_RE.finditer(xml)}
         
         return {
             'document_info': doc_info,
@@ -186,6 +545,52 @@ class SemaphoreClassificationClient:
             'raw_xml': xml
         }
     
+    def extract_url(self, result: Dict[str, Any]) -> Optional[str]:
+        """
+        Get the document URL from a classification result.
+        
+        Parsing stops at the end of the first URL element, which normally sits
+        near the start of the response, so the rest of the XML is not read.
+        
+        Args:
+            result (dict): The classification result in XML format.
+        
+        Returns:
+            str: The document URL, or None if the result has none.
+        """
+        if 'raw_response' not in result or '_parsed' in result:
+            return self.parse_classification_results(result).get('document_info', {}).get('url')
+        
+        xml = result['raw_response']
+        url_parts = []
+        in_url = False
+        
+        def start_element(name: str, attrs: Dict[str, str]) -> None:
+            nonlocal in_url
+            in_url = in_url or name == 'URL'
+        
+        def character_data(data: str) -> None:
+            if in_url:
+                url_parts.append(data)
+        
+        def end_element(name: str) -> None:
+            if name == 'URL':
+                raise _StopParsing
+        
+        parser = expat.ParserCreate('utf-8')
+        parser.StartElementHandler = start_element
+        parser.CharacterDataHandler = character_data
+        parser.EndElementHandler = end_element
+        try:
+            parser.Parse(xml.encode('utf-8'), True)
+        except _StopParsing:
+            return ''.join(url_parts)
+        except expat.ExpatError:
+            # Not well-formed: use the regex fallback
+            url_match = _URL_RE.search(xml)
+            return url_match.group(1) if url_match else None
+        return None
+    
     def get_top_classifications(self, result: Dict[str, Any], max_results: int = 10) -> List[Dict[str, Any]]:
         """
         Get top classifications sorted by score.
@@ -198,21 +603,94 @@ class SemaphoreClassificationClient:
             list: The top classifications sorted by score.
         """
         parsed = self.parse_classification_results(result)
-        all_classifications = []
-        
-        for category, items in parsed['classifications'].items():
-            for item in items:
-                if item['score'] is not None:
-                    all_classifications.append({
-                        'category': category,
-                        'value': item['value'],
-                        'score': item['score'],
-                        'id': item['id']
-                    })
-        
-        # Sort by score descending and return top results
-        all_classifications.sort(key=lambda x: x['score'], reverse=True)
-        return all_classifications[:max_results]
+        scored_items = (
+            (category, item)
+            for category, items in parsed['classifications'].items()
+            for item in items
+            if item['score'] is not None
+        )
+        
+        # Partial sort: only the top results are ordered, by score descending,
+        # and output dicts are built for those results alone
+        top_items = heapq.nlargest(max_results, scored_items, key=lambda pair: pair[1]['score'])
+        return [
+            {
+                'category': category,
+                'value': item['value'],
+                'score': item['score'],
+                'id': item['id']
+            }
+            for category, item in top_items
+        ]
+    
+    def top_for_category(self, result: Dict[str, Any], category: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Get the top scoring values for one classification category.
+        
+        Values that appear more than once keep their highest score. The
+        duplicates are collapsed while the XML is streamed, so the full
+        parsed structure is never built.
+        
+        Args:
+            result (dict): The classification result in XML format.
+            category (str): The META name to select, e.g. 'Generic_UPWARD'.
+            k (int): The maximum number of values to return.
+        
+        Returns:
+            list: (value, score) tuples sorted by score descending.
+        """
+        best = self._best_scores(result, category)
+        return heapq.nlargest(k, best.items(), key=itemgetter(1))
+    
+    def _best_scores(self, result: Dict[str, Any], category: str) -> Dict[str, float]:
+        """
+        Map each scored value in a category to its highest score.
+        
+        Args:
+            result (dict): The classification result in XML format.
+            category (str): The META name to select.
+        
+        Returns:
+            dict: The highest score seen for each value.
+        """
+        if 'raw_response' in result and '_parsed' not in result:
+            xml = result['raw_response']
+            best = {}
+            best_get = best.get
+            
+            def start_element(name: str, attrs: Dict[str, str]) -> None:
+                if name == 'META' and attrs.get('name') == category:
+                    score = attrs.get('score')
+                    if score:
+                        score = float(score)
+                        value = attrs.get('value')
+                        if score > best_get(value, -1):
+                            best[value] = score
+            
+            parser = expat.ParserCreate('utf-8')
+            parser.StartElementHandler = start_element
+            try:
+                parser.Parse(xml.encode('utf-8'), True)
+                return best
+            except expat.ExpatError:
+                pass
+        
+        # Already parsed, or not well-formed XML: use the cached parse or the
+        # regex fallback, without storing a parse on the caller's result
+        best = {}
+        best_get = best.get
+        if 'raw_response' in result and '_parsed' not in result:
+            parsed = self._parse_xml_regex(result['raw_response'])
+        else:
+            parsed = self.parse_classification_results(result)
+        for item in parsed.get('classifications', {}).get(category, []):
+            score = item['score']
+            if score is None:
+                continue
+            value = item['value']
+            if score > best_get(value, -1):
+                best[value] = score
+        return best
     
     def get_service_info(self) -> Dict[str, Any]:
         """
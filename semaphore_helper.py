@@ -8,13 +8,20 @@ download_preservica_assets.py script for Preservica integration to work.
 """
 
 import argparse
+import csv
+import functools
+import hashlib
 import os
+import shutil
 import sys
 import json
 import subprocess
+import tempfile
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from semaphore_classification_client import SemaphoreClassificationClient
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Tuple
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -23,23 +30,375 @@ load_dotenv(override=True)
 # Configuration
 DOWNLOAD_SCRIPT = os.getenv('DOWNLOAD_SCRIPT', 'fallback_path_here')
 
+# Classification results cached by file content hash; bumping the version
+# moves new entries to a fresh subdirectory
+RESULTS_CACHE_DIR = os.path.expanduser("~/.cache/semaphore/results")
+RESULTS_CACHE_VERSION = 1
+
+# Files larger than this are not hashed when deduplicating identical files
+DEDUPE_MAX_BYTES = 100 * 1024 * 1024
+
+# Plain-text formats that can be classified as text if the file upload is rejected
+TEXT_EXTS = frozenset({'.txt', '.text', '.md', '.csv', '.tsv', '.log', '.json', '.xml', '.htm', '.html', '.rtf'})
+
+# Largest amount of a file sent when it is classified as plain text
+DEFAULT_MAX_TEXT_BYTES = 2 * 1024 * 1024
+
+# Leading bytes expected for common binary formats; files whose header does
+# not match are skipped without contacting the service
+_ZIP_MAGIC = (b'PK\x03\x04',)
+_OLE_MAGIC = (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',)
+MAGIC = {
+    '.pdf': (b'%PDF-',),
+    '.docx': _ZIP_MAGIC, '.xlsx': _ZIP_MAGIC, '.pptx': _ZIP_MAGIC,
+    '.odt': _ZIP_MAGIC, '.ods': _ZIP_MAGIC, '.odp': _ZIP_MAGIC, '.epub': _ZIP_MAGIC,
+    '.doc': _OLE_MAGIC, '.xls': _OLE_MAGIC, '.ppt': _OLE_MAGIC, '.msg': _OLE_MAGIC,
+    '.rtf': (b'{\\rtf',),
+}
+
+# HTTP statuses the service returns for file formats it cannot classify
+UNSUPPORTED_FORMAT_STATUSES = (400, 415)
+
+# Use orjson for output serialisation and cache reads when it is installed
+try:
+    import orjson
+    
+    def _dumps(obj: Any, indent: bool = False) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode('utf-8')
+    
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj: Any, indent: bool = False) -> str:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
+    
+    _loads = json.loads
+
+# Show a progress bar for structured output runs when tqdm is installed
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+class JsonArrayWriter:
+    """Write a JSON array to a text stream one element at a time."""
+    
+    def __init__(self, stream, indent: bool = False):
+        self.stream = stream
+        self.indent = indent
+        self.count = 0
+    
+    def write(self, obj: Any) -> None:
+        self.stream.write((",\n" if self.count else "[\n") + _dumps(obj, indent=self.indent))
+        self.count += 1
+    
+    def close(self) -> None:
+        self.stream.write("\n]\n" if self.count else "[]\n")
+
+class JsonLinesWriter:
+    """Write JSON Lines to a text stream: one compact JSON document per line."""
+    
+    def __init__(self, stream):
+        self.stream = stream
+    
+    def write(self, obj: Any) -> None:
+        self.stream.write(_dumps(obj) + "\n")
+    
+    def close(self) -> None:
+        pass
+
+def looks_like_text(file_path: str) -> bool:
+    """Cheaply decide whether a file is plain text, from its extension or first bytes."""
+    if os.path.splitext(file_path)[1].lower() in TEXT_EXTS:
+        return True
+    with open(file_path, 'rb') as f:
+        return b'\x00' not in f.read(1024)
+
+def trim_to_utf8_boundary(data: bytes) -> bytes:
+    """Drop a multi-byte UTF-8 character left incomplete at the end of data by truncation."""
+    # Walk back over continuation bytes (0b10xxxxxx) to where the last character starts
+    start = len(data) - 1
+    while start > 0 and len(data) - start < 4 and data[start] & 0xC0 == 0x80:
+        start -= 1
+    try:
+        data[start:].decode('utf-8')
+    except UnicodeDecodeError:
+        return data[:start]
+    return data
+
+def file_digest(file_path: str) -> str:
+    """Return the SHA-256 hex digest of a file's contents, read in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def prepare_results_cache(cache_dir: Path) -> Path:
+    """
+    Create the results cache and return the directory holding its entries.
+    
+    Entries live in a subdirectory named after RESULTS_CACHE_VERSION, so
+    changing the version starts an empty cache without deleting anything
+    else that is stored in cache_dir.
+    """
+    entries_dir = cache_dir / f"v{RESULTS_CACHE_VERSION}"
+    entries_dir.mkdir(parents=True, exist_ok=True)
+    return entries_dir
+
+def result_cache_path(cache_dir: Path, file_path: str, threshold: Optional[int],
+                      title: Optional[str], endpoint: str, digest: Optional[str] = None,
+                      max_bytes: Optional[int] = None) -> Path:
+    """Return the cache file for a file's contents and the parameters sent with it."""
+    key = f"{digest or file_digest(file_path)}|{threshold}|{title}|{endpoint}|{max_bytes or 0}"
+    return cache_dir / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+def load_cached_result(cache_path: Path) -> Optional[Dict[str, Any]]:
+    """Load a cached classification result, or None if there is no usable entry."""
+    try:
+        with open(cache_path, 'rb') as f:
+            return _loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def write_json_atomic(path: Path, obj: Any) -> None:
+    """Write JSON to a temporary file and rename it into place, so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def save_cached_result(cache_path: Path, result: Dict[str, Any]) -> None:
+    """Store a classification result in the cache; failures are ignored."""
+    try:
+        write_json_atomic(cache_path, result)
+    except (OSError, TypeError, ValueError):
+        pass
+
+def precheck_file(file_path: str) -> Optional[str]:
+    """Return why a file cannot be classified (a header not matching its extension), or None."""
+    extension = os.path.splitext(file_path)[1].lower()
+    expected = MAGIC.get(extension)
+    if expected:
+        with open(file_path, 'rb') as f:
+            header = f.read(8)
+        if not header.startswith(expected):
+            return f"contents do not look like a {extension} file"
+    return None
+
 def classify_file(client: SemaphoreClassificationClient, file_path: str, 
-                 threshold: Optional[int] = None, title: Optional[str] = None) -> Dict[str, Any]:
-    """Classify a single file and return results."""
+                 threshold: Optional[int] = None, title: Optional[str] = None,
+                 cache_dir: Optional[Path] = None, refresh_cache: bool = False,
+                 digest: Optional[str] = None, max_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Classify a single file and return results.
+    
+    If cache_dir is given, successful results are cached by content hash and
+    reused for unchanged files unless refresh_cache is set. A precomputed
+    content digest can be passed to avoid hashing the file again. When the
+    file is sent as text, at most max_bytes are read and the result gets a
+    "warning" noting the truncation.
+    """
+    # Skip files that would certainly fail, without an API round-trip
+    problem = precheck_file(file_path)
+    if problem:
+        return {"error": f"Skipped {file_path}: {problem}"}
+    
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = result_cache_path(cache_dir, file_path, threshold, title,
+                                       client.classification_url, digest=digest, max_bytes=max_bytes)
+        if not refresh_cache:
+            cached = load_cached_result(cache_path)
+            if cached is not None:
+                return cached
+    
     try:
         # Try to classify as file first (for supported formats)
         result = client.classify_file(file_path, title=title, threshold=threshold)
-    except Exception as e:
-        # Fallback to reading as text
+    except requests.HTTPError as e:
+        # Only fall back when the service rejected the file's format, and only
+        # for text content; transport errors propagate to the caller
+        status = e.response.status_code if e.response is not None else None
+        if status not in UNSUPPORTED_FORMAT_STATUSES or not looks_like_text(file_path):
+            return {"error": f"Failed to process {file_path}: {str(e)}"}
+        
+        # Fallback to sending the contents as text; the bytes are passed through
+        # as-is rather than decoded to str only to be re-encoded for the request
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                text = f.read()
+            with open(file_path, 'rb') as f:
+                if max_bytes:
+                    # Read one extra byte to tell whether anything was cut off
+                    text = f.read(max_bytes + 1)
+                else:
+                    text = f.read()
+            truncated = bool(max_bytes) and len(text) > max_bytes
+            if truncated:
+                text = trim_to_utf8_boundary(text[:max_bytes])
             result = client.classify_text(text, title=title, threshold=threshold)
+            if truncated:
+                result["warning"] = f"Text truncated to the first {max_bytes} bytes"
         except Exception as e2:
             return {"error": f"Failed to process {file_path}: {str(e2)}"}
     
+    if cache_path is not None:
+        save_cached_result(cache_path, result)
     return result
 
+def find_files(directory: Path, recursive: bool, include_extensions: Iterable[str] = (),
+               exclude_extensions: Iterable[str] = ()) -> Iterator[Path]:
+    """
+    Yield the files in a directory from a single walk, filtered by extension.
+    
+    If include_extensions is given only those extensions are kept; otherwise
+    files with any of exclude_extensions are skipped. Entry types come from
+    os.scandir, so no extra stat() call is made per file on most platforms.
+    """
+    include = frozenset(ext.lower().lstrip('.') for ext in include_extensions)
+    exclude = frozenset(ext.lower().lstrip('.') for ext in exclude_extensions)
+    # Pick the extension test once, so each file costs one frozenset lookup
+    keep_extension = include.__contains__ if include else (lambda file_ext: file_ext not in exclude)
+    
+    def wanted(name: str) -> bool:
+        # Extension after the last dot; a leading dot (e.g. '.profile') is not one
+        dot = name.rfind('.')
+        return keep_extension(name[dot + 1:].lower() if dot > 0 else '')
+    
+    stack = [directory]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            # Skip directories that cannot be read, as os.walk does
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(entry.path)
+                elif entry.is_file() and wanted(entry.name):
+                    yield Path(entry.path)
+
+def split_by_size(files: List[Path], max_size: int = 0) -> Tuple[List[Path], List[Tuple[Path, str]]]:
+    """
+    Separate out files that are empty or larger than max_size bytes.
+    
+    A max_size of 0 means no upper limit. Files that cannot be stat()ed are
+    kept so the usual per-file error is reported for them.
+    
+    Returns:
+        tuple: The files worth classifying, and (file, reason) pairs for
+               the skipped ones.
+    """
+    kept = []
+    skipped = []
+    for file_path in files:
+        try:
+            size = file_path.stat().st_size
+        except OSError:
+            kept.append(file_path)
+            continue
+        if size == 0:
+            skipped.append((file_path, f"Skipped {file_path}: file is empty"))
+        elif max_size and size > max_size:
+            skipped.append((file_path, f"Skipped {file_path}: file is larger than {max_size} bytes"))
+        else:
+            kept.append(file_path)
+    return kept, skipped
+
+def group_by_content(files: List[Path], workers: int) -> Tuple[Dict[Path, List[Path]], Dict[Path, str]]:
+    """
+    Group files with identical contents, hashing them concurrently.
+    
+    Files larger than DEDUPE_MAX_BYTES, or that cannot be read, are not
+    hashed and form groups of their own.
+    
+    Returns:
+        tuple: A map from each group's representative file to its identical
+               copies, and the content digest of every hashed file.
+    """
+    def digest_or_none(file_path: Path) -> Optional[str]:
+        try:
+            if file_path.stat().st_size > DEDUPE_MAX_BYTES:
+                return None
+            return file_digest(str(file_path))
+        except OSError:
+            return None
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            digests = dict(zip(files, executor.map(digest_or_none, files)))
+        except KeyboardInterrupt:
+            # Drop the queued files rather than hashing them all on Ctrl-C
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    
+    groups = {}
+    representatives = {}
+    for file_path, digest in digests.items():
+        if digest is None:
+            groups[file_path] = []
+        elif digest in representatives:
+            groups[representatives[digest]].append(file_path)
+        else:
+            representatives[digest] = file_path
+            groups[file_path] = []
+    
+    return groups, {file_path: digest for file_path, digest in digests.items() if digest}
+
+def process_file(client: SemaphoreClassificationClient, file_path: Path,
+                 threshold: Optional[int], max_topics: int, cache_dir: Optional[Path] = None,
+                 refresh_cache: bool = False, digest: Optional[str] = None,
+                 max_bytes: Optional[int] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Classify a single file and return its file result alongside the raw result."""
+    file_result = {
+        "file": str(file_path),
+        "filename": file_path.name,
+        "classifications": [],
+        "error": None
+    }
+    
+    result = classify_file(client, str(file_path), threshold=threshold, title=file_path.stem,
+                           cache_dir=cache_dir, refresh_cache=refresh_cache, digest=digest,
+                           max_bytes=max_bytes)
+    
+    if "warning" in result:
+        file_result["warning"] = result["warning"]
+    
+    # Parse results
+    if "error" not in result:
+        # Get the top Generic_UPWARD classifications, keeping each topic's best score
+        top_classifications = client.top_for_category(result, "Generic_UPWARD", k=max_topics)
+        
+        # Store classifications
+        for value, score in top_classifications:
+            file_result["classifications"].append({
+                "topic": value,
+                "score": score
+            })
+    else:
+        file_result["error"] = result["error"]
+        result = {"error": result["error"]}
+    
+    return file_result, result
+
+def positive_int(value: str) -> int:
+    """argparse type for options that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+def non_negative_int(value: str) -> int:
+    """argparse type for options where 0 means no limit."""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or a positive integer, got {value}")
+    return number
+
 def main():
     """
     Main function that processes files for classification.
@@ -60,10 +419,19 @@ def main():
     parser.add_argument("--json", action="store_true", help="Output in JSON format for programmatic use")
     parser.add_argument("--csv", type=str, metavar="FILENAME", help="Output in CSV format to specified file")
     parser.add_argument("--raw-json", action="store_true", help="Print full raw classification responses to stdout as JSON")
+    parser.add_argument("--raw-json-format", choices=["json", "jsonl"], default="jsonl", help="Format for --raw-json: one JSON object per line (jsonl, default) or an indented JSON array (json)")
     parser.add_argument("--preservica-folder-ref", help="Download assets from Preservica folder before classification (requires DOWNLOAD_SCRIPT env var)")
     parser.add_argument("--keep-files", action="store_true", help="Keep downloaded files after processing (default: auto-delete when using Preservica)")
     parser.add_argument("--exclude-extensions", nargs="+", default=[], help="Exclude files with these extensions (e.g., mp4 avi mov)")
     parser.add_argument("--include-extensions", nargs="+", default=[], help="Only process files with these extensions (e.g., pdf txt doc)")
+    parser.add_argument("--refresh-token", action="store_true", help="Ignore any cached access token and authenticate again")
+    parser.add_argument("--refresh-cache", action="store_true", help="Re-classify every file instead of reusing cached results for unchanged files")
+    parser.add_argument("--cache-dir", default=RESULTS_CACHE_DIR, help=f"Directory for cached classification results (default: {RESULTS_CACHE_DIR})")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write cached classification results")
+    parser.add_argument("--dedupe", action="store_true", help="Classify files with identical contents once and reuse the result for every copy")
+    parser.add_argument("--max-bytes", type=non_negative_int, default=DEFAULT_MAX_TEXT_BYTES, help=f"Maximum bytes sent when a file is classified as plain text; 0 for no limit (default: {DEFAULT_MAX_TEXT_BYTES})")
+    parser.add_argument("--max-size", type=non_negative_int, default=0, help="Skip files larger than this many bytes without contacting the service; 0 for no limit (default: 0)")
+    parser.add_argument("--workers", type=positive_int, default=8, help="Number of files to classify concurrently (default: 8)")
     
     args = parser.parse_args()
     
@@ -106,7 +474,8 @@ def main():
     # Initialize client
     try:
         client = SemaphoreClassificationClient(api_key=args.api_key)
-        client.authenticate()
+        client.configure_pool(args.workers)
+        client.authenticate(use_cache=not args.refresh_token)
         print(f"✅ Authenticated successfully")
     except Exception as e:
         print(f"❌ Authentication failed: {e}")
@@ -118,169 +487,198 @@ def main():
         print(f"❌ Directory not found: {directory}")
         sys.exit(1)
     
-    # Collect all files (no extension filtering)
-    if args.recursive:
-        files_to_process = [f for f in directory.rglob("*") if f.is_file()]
-    else:
-        files_to_process = [f for f in directory.glob("*") if f.is_file()]
-
-    # Apply file type filtering
+    # Collect files in a single directory walk, filtering by extension as we go
+    files_to_process = list(find_files(directory, args.recursive,
+                                       include_extensions=args.include_extensions,
+                                       exclude_extensions=args.exclude_extensions))
     if args.exclude_extensions or args.include_extensions:
-        filtered_files = []
-        for file_path in files_to_process:
-            file_ext = file_path.suffix.lower().lstrip('.')
-            
-            # If include_extensions is specified, only process those extensions
-            if args.include_extensions:
-                if file_ext in [ext.lower().lstrip('.') for ext in args.include_extensions]:
-                    filtered_files.append(file_path)
-            # Otherwise, apply exclude_extensions filter
-            elif args.exclude_extensions:
-                if file_ext not in [ext.lower().lstrip('.') for ext in args.exclude_extensions]:
-                    filtered_files.append(file_path)
-            else:
-                filtered_files.append(file_path)
-        
-        files_to_process = filtered_files
         print(f"🔍 After filtering: {len(files_to_process)} files to process")
 
     print(f"📁 Found {len(files_to_process)} files to process")
     
-    # Process files
-    results = []
-    raw_results = []
+    # Empty and oversized files would only fail, so keep them out of the queue
+    files_to_process, skipped_files = split_by_size(files_to_process, args.max_size)
+    if skipped_files:
+        print(f"⏭️  Skipping {len(skipped_files)} empty or oversized files")
+    
+    # Optionally classify only one file per set of identical files
+    copies = {}
+    digests = {}
+    if args.dedupe:
+        copies, digests = group_by_content(files_to_process, args.workers)
+        files_to_process = list(copies)
+        print(f"🧬 {len(files_to_process)} files with unique contents to classify")
+    
+    # Set up the results cache
+    cache_dir = None
+    if not args.no_cache:
+        try:
+            cache_dir = prepare_results_cache(Path(args.cache_dir).expanduser())
+        except OSError as e:
+            print(f"⚠️  Warning: Results cache disabled: {e}")
+            cache_dir = None
+    
+    # Open the CSV output up front so rows are written as each file completes
+    csvfile = None
+    if args.csv and not args.json:
+        try:
+            # A 1 MiB buffer batches the per-row writes into few write() calls
+            csvfile = open(args.csv, 'w', newline='', encoding='utf-8', buffering=1 << 20)
+        except OSError as e:
+            print(f"❌ Failed to write CSV file: {e}")
+            sys.exit(1)
+        csv_writer = csv.writer(csvfile)
+        # Header: assetId, error, then one 'topic' column per requested topic
+        csv_writer.writerow(["assetId", "error"] + ["dc:subject"] * args.max_topics)
+    
+    # Structured output on stdout needs no per-line flushing, even on a
+    # terminal; let it fill the stream's buffer instead. A redirected stdout
+    # (e.g. io.StringIO) may have no reconfigure() and is left alone
+    reconfigure = getattr(sys.stdout, "reconfigure", None)
+    if reconfigure and (args.json or args.raw_json):
+        reconfigure(line_buffering=False)
+    
+    json_writer = JsonArrayWriter(sys.stdout) if args.json else None
     
-    for file_path in files_to_process:
-        file_result = {
+    # Raw results go straight to stdout when nothing else is printed there
+    # meanwhile; otherwise they are spooled and printed after the other output
+    raw_writer = None
+    if args.raw_json:
+        if csvfile:
+            raw_stream = sys.stdout
+        else:
+            raw_stream = tempfile.SpooledTemporaryFile(max_size=1 << 20, mode='w+', encoding='utf-8')
+        if args.raw_json_format == "jsonl":
+            raw_writer = JsonLinesWriter(raw_stream)
+        else:
+            raw_writer = JsonArrayWriter(raw_stream, indent=True)
+    
+    # Bind the per-file settings once rather than reading args for every file
+    max_topics = args.max_topics
+    include_scoring = args.include_scoring
+    
+    def emit_raw(file_path: Path, result: Dict[str, Any]) -> None:
+        raw_writer.write({
             "file": str(file_path),
             "filename": file_path.name,
-            "classifications": [],
-            "error": None
-        }
+            "raw_result": result
+        })
+    
+    def emit_json(file_path: Path, file_result: Dict[str, Any], failure: Optional[Exception]) -> None:
+        json_writer.write(file_result)
+    
+    def emit_csv(file_path: Path, file_result: Dict[str, Any], failure: Optional[Exception]) -> None:
+        row = [file_result["filename"], file_result["error"] or ""]
+        # Pad topic columns (all empty on error) up to the header width
+        topics = [c["topic"] for c in file_result["classifications"]]
+        row.extend(topics + [""] * (max_topics - len(topics)))
+        csv_writer.writerow(row)
+    
+    def emit_human(file_path: Path, file_result: Dict[str, Any], failure: Optional[Exception]) -> None:
+        print(file_path)
+        if failure:
+            print(f"Failed: {failure}")
+        elif file_result["error"]:
+            print(f"Error: {file_result['error']}")
+        else:
+            if "warning" in file_result:
+                print(f"Warning: {file_result['warning']}")
+            for classification in file_result["classifications"]:
+                if include_scoring:
+                    print(f"{classification['topic']} ({classification['score']:.2f})")
+                else:
+                    print(f"{classification['topic']}")
+        print()
+    
+    # Choose the output functions once, so writing a file's results does not
+    # re-test the output flags
+    emit = emit_json if json_writer else emit_csv if csvfile else emit_human
+    raw_sink = emit_raw if raw_writer else (lambda file_path, result: None)
+    
+    def write_outputs(file_path: Path, file_result: Dict[str, Any], result: Dict[str, Any],
+                      failure: Optional[Exception]) -> None:
+        raw_sink(file_path, result)
+        emit(file_path, file_result, failure)
+    
+    try:
+        # Report the files skipped before classification
+        for file_path, reason in skipped_files:
+            write_outputs(file_path, {
+                "file": str(file_path),
+                "filename": file_path.name,
+                "classifications": [],
+                "error": reason
+            }, {"error": reason}, None)
         
-        try:
-            result = classify_file(client, str(file_path), 
-                                 threshold=args.threshold, 
-                                 title=file_path.stem)
+        with client, ThreadPoolExecutor(max_workers=args.workers) as executor:
+            # Process files concurrently; outputs are written on the main thread
+            classify = functools.partial(process_file, client, threshold=args.threshold,
+                                         max_topics=max_topics, cache_dir=cache_dir,
+                                         refresh_cache=args.refresh_cache, max_bytes=args.max_bytes)
             
-            # Save the raw result for this file
-            if args.raw_json:
-                raw_results.append({
-                    "file": str(file_path),
-                    "filename": file_path.name,
-                    "raw_result": result
-                })
-
-            # Parse results
-            if "error" not in result:
-                parsed = client.parse_classification_results(result)
-                
-                # Get Generic_UPWARD classifications only
-                generic_upward = parsed.get("classifications", {}).get("Generic_UPWARD", [])
-                
-                # Sort by score (descending) and remove duplicates
-                unique_classifications = {}
-                for item in generic_upward:
-                    if item['score'] is not None:
-                        value = item['value']
-                        score = item['score']
-                        if value not in unique_classifications or score > unique_classifications[value]:
-                            unique_classifications[value] = score
-                
-                # Sort by score and take top results
-                sorted_classifications = sorted(unique_classifications.items(), 
-                                              key=lambda x: x[1], reverse=True)
+            try:
+                futures = {
+                    executor.submit(classify, file_path, digest=digests.get(file_path)): file_path
+                    for file_path in files_to_process
+                }
                 
-                # Store classifications
-                for value, score in sorted_classifications[:args.max_topics]:
-                    file_result["classifications"].append({
-                        "topic": value,
-                        "score": score
-                    })
+                completed = as_completed(futures)
+                # Per-file lines are the output in human-readable mode, so only
+                # show progress (on stderr) when results go to JSON or CSV
+                if tqdm and (json_writer or csvfile) and sys.stderr.isatty():
+                    completed = tqdm(completed, total=len(futures), desc="Classifying", unit="file")
                 
-                # Output based on format
-                if args.json or args.csv:
-                    results.append(file_result)
-                else:
-                    # Human-readable output
-                    print(file_path)
-                    for classification in file_result["classifications"]:
-                        if args.include_scoring:
-                            print(f"{classification['topic']} ({classification['score']:.2f})")
-                        else:
-                            print(f"{classification['topic']}")
-                    print()
-                
-            else:
-                file_result["error"] = result["error"]
-                if args.raw_json:
-                    raw_results.append({
-                        "file": str(file_path),
-                        "filename": file_path.name,
-                        "raw_result": {"error": result["error"]}
-                    })
-                if args.json or args.csv:
-                    results.append(file_result)
-                else:
-                    print(f"{file_path}")
-                    print(f"Error: {result['error']}")
-                    print()
-                
-        except Exception as e:
-            file_result["error"] = str(e)
-            if args.raw_json:
-                raw_results.append({
-                    "file": str(file_path),
-                    "filename": file_path.name,
-                    "raw_result": {"error": str(e)}
-                })
-            if args.json or args.csv:
-                results.append(file_result)
-            else:
-                print(f"{file_path}")
-                print(f"Failed: {e}")
-                print()
-    
-    # Output structured results
-    if args.json:
-        print(json.dumps(results, indent=2))
-    elif args.csv:
-        import csv
-        try:
-            # Find the maximum number of topics for any file
-            max_topics = 0
-            for result in results:
-                if not result["error"]:
-                    num_topics = len(result["classifications"])
-                    if num_topics > max_topics:
-                        max_topics = num_topics
-
-            # Prepare header: assetId, error, then 'topic' columns
-            header = ["assetId", "error"] + ["dc:subject"] * max_topics
-
-            with open(args.csv, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(header)
-
-                for result in results:
-                    row = [result["filename"]]
-                    row.append(result["error"] if result["error"] else "")
-                    if not result["error"]:
-                        topics = [c["topic"] for c in result["classifications"]]
-                        # Pad with empty strings if fewer topics than max
-                        topics += [""] * (max_topics - len(topics))
-                        row.extend(topics)
-                    else:
-                        # If error, fill topic columns with empty strings
-                        row.extend([""] * max_topics)
-                    writer.writerow(row)
+                for future in completed:
+                    file_path = futures[future]
+                    failure = None
+                    try:
+                        file_result, result = future.result()
+                    except Exception as e:
+                        failure = e
+                        file_result = {
+                            "file": str(file_path),
+                            "filename": file_path.name,
+                            "classifications": [],
+                            "error": str(e)
+                        }
+                        result = {"error": str(e)}
+                    
+                    write_outputs(file_path, file_result, result, failure)
+                    
+                    # Fan the shared result out to identical copies of this file
+                    for copy_path in copies.get(file_path, ()):
+                        copy_result = dict(file_result, file=str(copy_path), filename=copy_path.name)
+                        copy_raw = result
+                        if file_result["error"]:
+                            # Error messages name the file; name the copy instead
+                            error = file_result["error"].replace(str(file_path), str(copy_path))
+                            copy_result["error"] = error
+                            copy_raw = dict(result, error=error)
+                        write_outputs(copy_path, copy_result, copy_raw, failure)
+            except KeyboardInterrupt:
+                # Drop the queued files rather than finishing the batch on Ctrl-C
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        
+        # Close structured output, finishing the raw results before any
+        # further status message is printed
+        if json_writer:
+            json_writer.close()
+        
+        if raw_writer:
+            raw_writer.close()
+            if raw_stream is not sys.stdout:
+                raw_stream.seek(0)
+                shutil.copyfileobj(raw_stream, sys.stdout)
+        
+        if csvfile:
+            csvfile.close()
             print(f"✅ CSV output written to: {args.csv}")
-        except Exception as e:
-            print(f"❌ Failed to write CSV file: {e}")
-            sys.exit(1)
-
-    if args.raw_json:
-        print(json.dumps(raw_results, indent=2, ensure_ascii=False))
+    finally:
+        if csvfile:
+            csvfile.close()
+        if raw_writer and raw_stream is not sys.stdout:
+            raw_stream.close()
 
     # Cleanup: Delete downloaded files unless --keep-files is specified
     if args.preservica_folder_ref and not args.keep_files:
@@ -288,10 +686,12 @@ def main():
         try:
             directory = Path(args.directory)
             if directory.exists():
-                for file_path in directory.iterdir():
-                    if file_path.is_file():
-                        file_path.unlink()
-                        print(f"  Deleted: {file_path.name}")
+                # scandir entries carry their type, so no stat() per file
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            os.unlink(entry.path)
+                            print(f"  Deleted: {entry.name}")
                 # Remove the directory if it's empty
                 if not any(directory.iterdir()):
                     directory.rmdir()